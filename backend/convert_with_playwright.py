@@ -3,6 +3,9 @@
 Render local Marrow HTML files to PDFs with full styling using Playwright (Chromium).
 - Removes site header/footer UI.
 - Cuts content at the first occurrence of "MCQ ID:" while preserving original page styles.
+  The cut is done on the raw HTML before loading when the markers can be located there,
+  falling back to an in-page DOM pass otherwise.
+- Renders several files concurrently on a single Chromium instance (--workers).
 
 Usage:
   .venv/bin/python convert_with_playwright.py \
@@ -11,18 +14,27 @@ Usage:
     --out-dir "/Volumes/MainSSD/Indra_Developement/Desktop/pdfs_styled"
 
 Prereqs:
-  .venv/bin/python -m pip install playwright
+  .venv/bin/python -m pip install playwright pikepdf
   .venv/bin/python -m playwright install chromium
 """
 from __future__ import annotations
 
 import argparse
-import fnmatch
+import asyncio
+import base64
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import tempfile
+import time
 from pathlib import Path
-from typing import List
+from typing import Callable, FrozenSet, List, Optional, Union
 
-from playwright.sync_api import sync_playwright
-from pypdf import PdfWriter, PdfReader
+from playwright.async_api import async_playwright
+
+from merge_pdfs import MERGE_ENGINES, MergeError, OrderedMerger, _scan, merge_files
 
 
 JS_REMOVE_AND_CUT = r"""
@@ -101,100 +113,573 @@ JS_REMOVE_AND_CUT = r"""
   return true;
 })
 """
+# JS_REMOVE_AND_CUT is registered once per context as an init script; per page we only
+# send this short call instead of shipping and recompiling the full source every time.
+JS_INIT_REMOVE_AND_CUT = f"window.__trimToMcq = {JS_REMOVE_AND_CUT.strip()};"
+JS_CALL_REMOVE_AND_CUT = "window.__trimToMcq({qnum})"
+
+# Readiness probe used instead of networkidle + fixed sleep: body content, then web fonts,
+# then completed subresources, each step bounded by its own timeout. It runs as a single
+# awaited Runtime.evaluate; local file:// pages have no XHR traffic, so on static
+# documents every step resolves almost immediately. Timing out is not an error.
+READY_TIMEOUT_MS = 2000
+JS_WAIT_READY = r"""
+(async (timeout) => {
+  const delay = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+  const until = async (pred) => {
+    const deadline = Date.now() + timeout;
+    while (!pred() && Date.now() < deadline) await delay(20);
+  };
+  await until(() => document.body && document.body.firstElementChild);
+  if (document.fonts) await Promise.race([document.fonts.ready, delay(timeout)]);
+  await until(() => document.readyState === 'complete'
+    && performance.getEntriesByType('resource').every((r) => r.responseEnd > 0));
+  return true;
+})(%d)
+""" % READY_TIMEOUT_MS
+# Navigation attempts as (CDP event to wait for, timeout_ms): fail fast on a slow file, then
+# retry once returning as soon as the navigation commits, so one outlier doesn't hold a
+# worker for the 30s default timeout
+GOTO_ATTEMPTS = (('Page.domContentEventFired', 5000), (None, 8000))
+GOTO_BACKOFF_S = 0.25
+DEFAULT_MAX_SECONDS_PER_FILE = 60.0
+# Upper bound for closing a failed page and opening its replacement
+PAGE_REPLACE_TIMEOUT_S = 30.0
+
+# Input is trusted local HTML rendered headless, so background services, GPU and the
+# sandbox only add subprocesses and startup time
+CHROMIUM_ARGS = [
+  '--disable-gpu',
+  '--disable-dev-shm-usage',
+  '--no-sandbox',
+  '--disable-extensions',
+  '--disable-background-networking',
+  '--disable-sync',
+  '--disable-default-apps',
+  '--disable-translate',
+  '--disable-features=TranslateUI,BlinkGenPropertyTrees',
+  '--mute-audio',
+  '--hide-scrollbars',
+  '--font-render-hinting=none',
+  # Vector PDF output keeps no subpixel AA, so skip glyph AA passes and extra raster work
+  '--disable-lcd-text',
+  '--disable-font-subpixel-positioning',
+  '--force-device-scale-factor=1',
+  '--disable-smooth-scrolling',
+  '--disable-partial-raster',
+]
+CONTEXT_OPTIONS = dict(
+  # US-Letter at 96dpi, the printed paper size, so nothing is laid out or sampled at another scale
+  viewport={'width': 816, 'height': 1056},
+  device_scale_factor=1,
+  java_script_enabled=True,
+  bypass_csp=True,
+  service_workers='block',
+)
+
+# Page.printToPDF parameters matching page.pdf(print_background=True, prefer_css_page_size=True):
+# Playwright defaults to Letter paper with zero margins, scale 1 and untagged output, whereas
+# raw CDP leaves margins and tagging to Chromium's own (embedder) defaults
+PRINT_TO_PDF_PARAMS = {
+  'printBackground': True,
+  'preferCSSPageSize': True,
+  'scale': 1,
+  'generateTaggedPDF': False,
+  'paperWidth': 8.5,
+  'paperHeight': 11,
+  'marginTop': 0,
+  'marginBottom': 0,
+  'marginLeft': 0,
+  'marginRight': 0,
+  'transferMode': 'ReturnAsStream',
+}
+PDF_READ_CHUNK = 1 << 20
+
+# Resource blocking is opt-in: while a route is installed Playwright disables the HTTP cache
+# and every request waits on a Python handler, so shared CDN assets would be refetched per file.
+# WebSockets never pass through context.route, so they can't be blocked here.
+DEFAULT_BLOCKED_RESOURCES = ''
+REMOTE_SCHEMES = ('http:', 'https:')
+
+# Byte-level equivalents of the markers used by JS_REMOVE_AND_CUT
+MCQ_RE = re.compile(rb'\bMCQ\s*ID\s*:', re.I)
+BODY_OPEN_RE = re.compile(rb'<body\b[^>]*>', re.I)
+HEAD_OPEN_RE = re.compile(rb'<head\b[^>]*>', re.I)
+BASE_RE = re.compile(rb'<base\b', re.I)
+# Text node that starts with a question number; compared against qnum after matching so
+# the pattern is compiled once rather than per file
+QNUM_RE = re.compile(rb'>\s*(?:Q\.?\s*)?(\d+)(?:[).:,-])?\s*(?=\W)', re.I)
+# Comments and raw-text elements are skipped as a whole; anything else is a tag
+TAG_RE = re.compile(
+  rb'<!--.*?-->|<(script|style)\b.*?</\1\s*>|<(/?)([a-zA-Z][\w:-]*)\b[^>]*?(/?)>',
+  re.I | re.S,
+)
+RAW_TEXT_TAGS = {b'script', b'style'}
+VOID_TAGS = {
+  b'area', b'base', b'br', b'col', b'embed', b'hr', b'img', b'input',
+  b'link', b'meta', b'param', b'source', b'track', b'wbr',
+}
+
+
+def _input_sort_key(stem: str):
+  return (0, int(stem)) if stem.isdigit() else (1, stem.lower())
 
 
 def iter_input_files(input_dir: Path, pattern: str) -> List[Path]:
-  files: List[Path] = []
-  for entry in input_dir.iterdir():
-    if entry.is_file() and fnmatch.fnmatch(entry.name, pattern):
-      files.append(entry)
-
-  def sort_key(p: Path):
-    stem = p.stem
-    if stem.isdigit():
-      return (0, int(stem))
+  return _scan(input_dir, pattern, _input_sort_key)
+
+
+def _open_tags(fragment: bytes) -> List[tuple]:
+  """
+  Return the elements still unclosed at the end of fragment, outermost first, as
+  (name, offset of the opening tag in fragment, opening tag bytes).
+  """
+  stack: List[tuple] = []
+  for m in TAG_RE.finditer(fragment):
+    name = m.group(3)
+    if name is None:
+      continue
+    name = name.lower()
+    if m.group(2):
+      # Pop up to the matching opener; stray closers are ignored
+      for i in range(len(stack) - 1, -1, -1):
+        if stack[i][0] == name:
+          del stack[i:]
+          break
+    elif not m.group(4) and name not in VOID_TAGS:
+      stack.append((name, m.start(), m.group(0)))
+  return stack
+
+
+def _in_raw_text(stack: List[tuple]) -> bool:
+  """True if an open <script>/<style> is on the stack, i.e. the position is not markup text."""
+  return any(name in RAW_TEXT_TAGS for name, _, _ in stack)
+
+
+def _in_text(data, pos: int) -> bool:
+  """True if pos lies in text content, i.e. not inside a tag's markup."""
+  return data.rfind(b'>', 0, pos) >= data.rfind(b'<', 0, pos)
+
+
+def preprocess_html(html_path: Path, qnum: Optional[str]) -> Optional[Path]:
+  """
+  Trim the body of html_path to [question start .. before "MCQ ID:"] on the raw bytes,
+  mirroring JS_REMOVE_AND_CUT: the kept range starts at the element holding the question
+  number text and ends before the element holding the "MCQ ID:" text. The <head> is kept
+  intact and the ancestors of the question are re-opened so container styles still apply.
+  Unlike the in-page cut, <script>s in <body> outside the kept range are dropped before
+  they ever run.
+
+  Returns a file in the system temp dir with a <base href> pointing at html_path's
+  directory (so relative URLs still resolve), or None if the markers could not be
+  located reliably or the copy could not be written; the caller must delete it.
+  """
+  if not qnum:
+    return None
+  qnum_bytes = qnum.encode()
+  try:
+    with html_path.open('rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      body = BODY_OPEN_RE.search(data)
+      if not body:
+        return None
+      # The injected <base> must come before any relative URL, and must not fight an existing one
+      head = HEAD_OPEN_RE.search(data, 0, body.start())
+      if not head or BASE_RE.search(data, head.end(), body.start()):
+        return None
+      mcq = MCQ_RE.search(data, body.end())
+      if not mcq or not _in_text(data, mcq.start()):
+        return None
+      q = next((m for m in QNUM_RE.finditer(data, body.end(), mcq.start()) if m.group(1) == qnum_bytes), None)
+      if not q:
+        return None
+      # The innermost element open where the question text starts is its parent; the ones
+      # around it are re-opened in the trimmed copy
+      ancestors = _open_tags(data[body.end():q.start() + 1])
+      if not ancestors or _in_raw_text(ancestors):
+        return None
+      q_start = body.end() + ancestors[-1][1]
+      # Likewise the innermost element open at "MCQ ID:", scanned from the question element;
+      # if it opened before the question element (or is it), the cut isn't a clean range
+      mcq_parents = _open_tags(data[q_start:mcq.start()])
+      if not mcq_parents or mcq_parents[-1][1] == 0 or _in_raw_text(mcq_parents):
+        return None
+      mcq_start = q_start + mcq_parents[-1][1]
+      base = b'<base href="' + html_path.parent.resolve().as_uri().encode() + b'/">'
+      trimmed = b''.join([
+        data[:head.end()],
+        base,
+        data[head.end():body.end()],
+        *(tag for _, _, tag in ancestors[:-1]),
+        data[q_start:mcq_start],
+        b'</body></html>',
+      ])
+  except (OSError, ValueError):
+    return None
+
+  # Kept out of the input dir so an interrupted run never leaves files that match --pattern
+  try:
+    fd, tmp_name = tempfile.mkstemp(prefix=f'trim_{html_path.stem}_', suffix='.html')
+  except OSError:
+    return None
+  try:
+    with os.fdopen(fd, 'wb') as out:
+      out.write(trimmed)
+  except OSError:
+    os.unlink(tmp_name)
+    return None
+  return Path(tmp_name)
+
+
+async def install_resource_blocking(context, blocked_types: FrozenSet[str], block_remote: bool) -> None:
+  """Abort requests the PDF doesn't need before Chromium fetches them."""
+  if not blocked_types and not block_remote:
+    return
+
+  async def handle(route):
+    request = route.request
+    if request.resource_type in blocked_types or (block_remote and request.url.startswith(REMOTE_SCHEMES)):
+      await route.abort()
     else:
-      return (1, stem.lower())
-
-  return sorted(files, key=sort_key)
+      await route.continue_()
+
+  await context.route('**/*', handle)
+
+
+def pdf_path_for(out_dir: Path, html_path: Path) -> Path:
+  return out_dir / f"{html_path.stem}.pdf"
+
+
+async def open_pooled_page(context):
+  """
+  Create a page together with the CDP session that drives it. The hot path talks to
+  Chromium over this session directly, avoiding several Playwright driver round trips
+  per file; per-page state that survives navigation is set up here once.
+  """
+  page = await context.new_page()
+  cdp = await context.new_cdp_session(page)
+  await cdp.send('Page.enable')
+  # Use screen media to avoid sites' @media print rules that hide content
+  await page.emulate_media(media='screen')
+  return page, cdp
+
+
+async def cdp_evaluate(cdp, expression: str, await_promise: bool = False):
+  result = await cdp.send('Runtime.evaluate', {
+    'expression': expression,
+    'awaitPromise': await_promise,
+    'returnByValue': True,
+  })
+  if 'exceptionDetails' in result:
+    details = result['exceptionDetails']
+    raise RuntimeError(details.get('exception', {}).get('description') or details.get('text'))
+  return result['result'].get('value')
+
+
+class NavigationTimeout(Exception):
+  """A navigation attempt ran out of time; distinct from the per-file limit's TimeoutError."""
+
+
+async def cdp_navigate(cdp, url: str, event: Optional[str], timeout_ms: int) -> None:
+  """Navigate via Page.navigate and wait for event (None = return once committed)."""
+  loop = asyncio.get_running_loop()
+  fired = loop.create_future()
+
+  def on_event(_params) -> None:
+    if not fired.done():
+      fired.set_result(None)
+
+  if event is not None:
+    cdp.on(event, on_event)
+  try:
+    async def navigate() -> None:
+      result = await cdp.send('Page.navigate', {'url': url})
+      if result.get('errorText'):
+        raise RuntimeError(f"navigation failed: {result['errorText']}")
+      if event is not None:
+        await fired
+
+    try:
+      await asyncio.wait_for(navigate(), timeout_ms / 1000)
+    except asyncio.TimeoutError:
+      raise NavigationTimeout(f"navigation did not finish within {timeout_ms}ms") from None
+  finally:
+    if event is not None:
+      cdp.remove_listener(event, on_event)
+
+
+async def _read_stream(cdp, handle: str, write: Callable[[bytes], object]) -> None:
+  try:
+    while True:
+      chunk = await cdp.send('IO.read', {'handle': handle, 'size': PDF_READ_CHUNK})
+      data = chunk['data']
+      write(base64.b64decode(data) if chunk.get('base64Encoded') else data.encode('latin-1'))
+      if chunk.get('eof'):
+        break
+  finally:
+    await cdp.send('IO.close', {'handle': handle})
+
+
+async def print_pdf(cdp, out_pdf: Optional[Path]) -> Optional[bytes]:
+  """
+  Print the page via CDP as an IO stream, writing chunks to out_pdf as they arrive
+  instead of receiving the whole document as one base64 string. Returns the bytes
+  when out_pdf is None.
+
+  Chunks go to a sibling <name>.part file that replaces out_pdf only once the stream
+  is complete, so a failed or cancelled print never leaves (or overwrites with) a
+  truncated PDF.
+  """
+  result = await cdp.send('Page.printToPDF', PRINT_TO_PDF_PARAMS)
+  if out_pdf is None:
+    buf = bytearray()
+    await _read_stream(cdp, result['stream'], buf.extend)
+    return bytes(buf)
+  part = out_pdf.with_name(out_pdf.name + '.part')
+  try:
+    with part.open('wb') as f:
+      await _read_stream(cdp, result['stream'], f.write)
+    os.replace(part, out_pdf)
+  except BaseException:
+    # Includes CancelledError from the per-file time limit
+    part.unlink(missing_ok=True)
+    raise
+  return None
+
+
+async def goto_with_retry(cdp, url: str) -> None:
+  for attempt, (event, timeout) in enumerate(GOTO_ATTEMPTS):
+    try:
+      await cdp_navigate(cdp, url, event, timeout)
+      return
+    except NavigationTimeout:
+      if attempt == len(GOTO_ATTEMPTS) - 1:
+        raise
+      await asyncio.sleep(GOTO_BACKOFF_S * (attempt + 1))
+
+
+def _discard_trimmed(prep: "asyncio.Future[Optional[Path]]") -> None:
+  """Done-callback: delete the temp file of a preprocess whose render was abandoned."""
+  if not prep.cancelled() and prep.exception() is None and prep.result() is not None:
+    prep.result().unlink(missing_ok=True)
+
+
+async def render_one(pooled, html_path: Path, out_dir: Optional[Path]) -> Union[Path, bytes]:
+  """Print html_path to out_dir, or return the PDF bytes when out_dir is None."""
+  _page, cdp = pooled
+  # Use file stem as question number if numeric
+  stem = html_path.stem
+  qnum = stem if stem.isdigit() else None
+  # mmap + regex scan is blocking; keep it off the event loop so other pages keep rendering
+  prep = asyncio.ensure_future(asyncio.to_thread(preprocess_html, html_path, qnum))
+  try:
+    trimmed = await asyncio.shield(prep)
+  except asyncio.CancelledError:
+    # The thread still finishes after a timeout; remove whatever temp file it writes
+    prep.add_done_callback(_discard_trimmed)
+    raise
+  try:
+    url = (trimmed or html_path).resolve().as_uri()
+    await goto_with_retry(cdp, url)
+    # Wait for content, fonts and late subresources instead of networkidle + fixed sleep
+    await cdp_evaluate(cdp, JS_WAIT_READY, await_promise=True)
+
+    # Remove top UI and keep only [Question..before MCQ ID], unless already trimmed on disk
+    if trimmed is None:
+      _result = await cdp_evaluate(cdp, JS_CALL_REMOVE_AND_CUT.format(qnum=json.dumps(qnum)))
+
+    # Print to PDF (backgrounds on, prefer CSS-defined page size)
+    if out_dir is None:
+      return await print_pdf(cdp, None)
+    out_pdf = pdf_path_for(out_dir, html_path)
+    await print_pdf(cdp, out_pdf)
+    return out_pdf
+  finally:
+    if trimmed is not None:
+      trimmed.unlink(missing_ok=True)
+
+
+async def render_all(
+  files: List[Path],
+  out_dir: Optional[Path],
+  workers: int,
+  blocked_types: FrozenSet[str] = frozenset(),
+  block_remote: bool = False,
+  on_result: Optional[Callable[[int, Union[Path, bytes, None]], None]] = None,
+  max_seconds: Optional[float] = DEFAULT_MAX_SECONDS_PER_FILE,
+) -> List[bool]:
+  """
+  Render all files concurrently on one browser; returns per-file success in input order.
+  on_result(index, pdf) is called as each file finishes, in completion order, with the
+  written path (or the PDF bytes when out_dir is None), or None if the file failed.
+  A file taking longer than max_seconds in total is abandoned and counted as failed.
+  """
+  async with async_playwright() as p:
+    browser = await p.chromium.launch(args=CHROMIUM_ARGS)
+    context = await browser.new_context(**CONTEXT_OPTIONS)
+    await context.add_init_script(script=JS_INIT_REMOVE_AND_CUT)
+    await install_resource_blocking(context, blocked_types, block_remote)
+    # Pages (and their CDP sessions) are created once and reused across files so each
+    # file skips target creation
+    pool: asyncio.Queue = asyncio.Queue()
+    for _ in range(min(workers, len(files))):
+      pool.put_nowait(await open_pooled_page(context))
+    alive = pool.qsize()
+
+    async def replace_page(pooled):
+      """Close a failed page and open a fresh one; None if the browser can't provide one."""
+      try:
+        await asyncio.wait_for(pooled[0].close(), PAGE_REPLACE_TIMEOUT_S)
+      except Exception:
+        pass
+      try:
+        return await asyncio.wait_for(open_pooled_page(context), PAGE_REPLACE_TIMEOUT_S)
+      except Exception as e:
+        print(f"[WARN] could not replace browser page: {e}")
+        return None
+
+    async def worker(index: int, html_path: Path) -> bool:
+      nonlocal alive
+      pooled = await pool.get()
+      out_pdf: Union[Path, bytes, None] = None
+      started = time.perf_counter()
+      try:
+        if pooled is None:
+          # Every page was lost; pass the marker on so the remaining files fail fast too
+          print(f"[FAIL] {html_path.name} : no browser pages left")
+          return False
+        try:
+          out_pdf = await asyncio.wait_for(render_one(pooled, html_path, out_dir), max_seconds)
+        except asyncio.TimeoutError:
+          # Inner timeouts raise their own exception types, so this is the per-file limit
+          raise TimeoutError(f"exceeded {max_seconds:g}s per-file limit") from None
+        target = f" -> {out_pdf.name}" if isinstance(out_pdf, Path) else ""
+        print(f"[OK]   {html_path.name}{target} ({time.perf_counter() - started:.2f}s)")
+        return True
+      except Exception as e:
+        print(f"[FAIL] {html_path.name} : {e} ({time.perf_counter() - started:.2f}s)")
+        # Don't hand a possibly wedged page to the next file
+        pooled = await replace_page(pooled)
+        if pooled is None:
+          alive -= 1
+        return False
+      finally:
+        if pooled is not None or alive == 0:
+          pool.put_nowait(pooled)
+        if on_result is not None:
+          on_result(index, out_pdf)
+
+    try:
+      return await asyncio.gather(*(worker(i, f) for i, f in enumerate(files)))
+    finally:
+      # Closing the context also closes every pooled page
+      await context.close()
+      await browser.close()
+
+
+def _render_partition(job: tuple) -> List[bool]:
+  """multiprocessing entry point: render one slice of the files on a browser of its own."""
+  files, out_dir, workers, blocked_types, block_remote, max_seconds = job
+  return asyncio.run(render_all(files, out_dir, workers, blocked_types, block_remote, max_seconds=max_seconds))
+
+
+def render_with_browsers(
+  files: List[Path],
+  out_dir: Path,
+  browsers: int,
+  workers: int,
+  blocked_types: FrozenSet[str],
+  block_remote: bool,
+  max_seconds: Optional[float] = DEFAULT_MAX_SECONDS_PER_FILE,
+) -> List[bool]:
+  """
+  Spread files over separate processes, each running its own Chromium with `workers`
+  pages, to scale past what one browser's renderers can use. Only paths and success
+  flags cross the process boundary; results keep input order.
+  """
+  n = min(browsers, len(files))
+  jobs = [(files[i::n], out_dir, workers, blocked_types, block_remote, max_seconds) for i in range(n)]
+  with multiprocessing.Pool(n) as pool:
+    parts = pool.map(_render_partition, jobs)
+  results: List[bool] = [False] * len(files)
+  for i, part in enumerate(parts):
+    results[i::n] = part
+  return results
 
 
 def main() -> int:
   ap = argparse.ArgumentParser(description="Convert local HTML to styled PDFs via Playwright (Chromium)")
   ap.add_argument('--input-dir', type=str, required=True)
   ap.add_argument('--pattern', type=str, default='*.html')
-  ap.add_argument('--out-dir', type=str, required=True)
+  ap.add_argument('--out-dir', type=str, help='Directory for per-file PDFs (required unless --no-keep-individual)')
   ap.add_argument('--combined-output', type=str, help='Optional: path to a single merged PDF to create after individual PDFs are generated')
+  ap.add_argument('--no-keep-individual', action='store_true',
+                  help='With --combined-output: merge PDFs straight from memory and write no per-file PDFs (--out-dir is not needed)')
+  ap.add_argument('--engine', choices=MERGE_ENGINES, default='pikepdf', help='PDF merge backend for --combined-output (default: pikepdf)')
+  ap.add_argument('--linearize', action='store_true', help='Linearize --combined-output (web-optimized) for progressive loading; slower to produce')
+  ap.add_argument('--merge-jobs', type=int, default=os.cpu_count() or 1, help='Worker processes for sharded merging of large --combined-output runs (default: cpu_count)')
+  ap.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 8), help='Number of pages rendered concurrently (default: min(cpu_count, 8))')
+  ap.add_argument('--parallel-browsers', type=int, default=1, help='Number of Chromium processes to split the files across, each with --workers pages (default: 1)')
+  ap.add_argument('--max-seconds-per-file', type=float, default=DEFAULT_MAX_SECONDS_PER_FILE,
+                  help=f'Abandon a file (counted as failed) after this many seconds; 0 disables the limit (default: {DEFAULT_MAX_SECONDS_PER_FILE:g})')
+  ap.add_argument('--block-resources', type=str, default=DEFAULT_BLOCKED_RESOURCES,
+                  help='Comma-separated Playwright resource types to abort, e.g. image,font,media (default: none; '
+                       'blocking disables the browser HTTP cache)')
+  ap.add_argument('--block-remote', action='store_true', help='Abort every http(s) request; only local file:// content is loaded')
   args = ap.parse_args()
+  if args.no_keep_individual and not (args.combined_output and args.engine == 'pikepdf'):
+    ap.error('--no-keep-individual requires --combined-output with --engine pikepdf')
+  if args.no_keep_individual and args.parallel_browsers > 1:
+    ap.error('--no-keep-individual cannot be combined with --parallel-browsers')
+  if not args.out_dir and not args.no_keep_individual:
+    ap.error('--out-dir is required unless --no-keep-individual is given')
 
   in_dir = Path(args.input_dir).expanduser().resolve()
-  out_dir = Path(args.out_dir).expanduser().resolve()
-  out_dir.mkdir(parents=True, exist_ok=True)
+  # Nothing is written per file with --no-keep-individual, so don't create (or need) out_dir
+  out_dir = None if args.no_keep_individual else Path(args.out_dir).expanduser().resolve()
+  if out_dir is not None:
+    out_dir.mkdir(parents=True, exist_ok=True)
 
   files = iter_input_files(in_dir, args.pattern)
   if not files:
     print(f"No files matched in {in_dir} with pattern {args.pattern}")
     return 0
 
-  print(f"Found {len(files)} files. Printing to {out_dir} ...")
-
-  with sync_playwright() as p:
-    browser = p.chromium.launch()
-    context = browser.new_context()
-
-    ok = 0
-    fail = 0
-    generated_pdfs: List[Path] = []
-    for html_path in files:
-      try:
-        page = context.new_page()
-        url = html_path.resolve().as_uri()
-        page.goto(url, wait_until='load')
-        # Ensure all subresources finish and JS (if any) runs
-        page.wait_for_load_state('networkidle')
-        # Use screen media to avoid sites' @media print rules that hide content
-        page.emulate_media(media='screen')
-        # Small delay to allow late layout/animations to settle
-        page.wait_for_timeout(200)
-
-        # Remove top UI and keep only [Question..before MCQ ID]. Use file stem as question number if numeric.
-        stem = html_path.stem
-        qnum = stem if stem.isdigit() else None
-        _result = page.evaluate(JS_REMOVE_AND_CUT, qnum)
-
-        # Print to PDF (backgrounds on, prefer CSS-defined page size)
-        out_pdf = out_dir / f"{html_path.stem}.pdf"
-        page.pdf(path=str(out_pdf), print_background=True, prefer_css_page_size=True)
-        print(f"[OK]   {html_path.name} -> {out_pdf.name}")
-        ok += 1
-        generated_pdfs.append(out_pdf)
-      except Exception as e:
-        print(f"[FAIL] {html_path.name} : {e}")
-        fail += 1
-      finally:
-        try:
-          page.close()
-        except Exception:
-          pass
-
-    context.close()
-    browser.close()
+  workers = max(1, args.workers)
+  browsers = max(1, args.parallel_browsers)
+  target = out_dir if out_dir is not None else 'memory'
+  print(f"Found {len(files)} files. Printing to {target} with {workers} workers x {browsers} browsers ...")
+
+  blocked_types = frozenset(t.strip().lower() for t in args.block_resources.split(',') if t.strip())
+  max_seconds = args.max_seconds_per_file if args.max_seconds_per_file > 0 else None
+  combined_path = Path(args.combined_output).expanduser().resolve() if args.combined_output else None
+  # With pikepdf in a single browser the combined PDF is built while rendering is still in
+  # progress; with several browsers it is merged (sharded) afterwards in this process
+  merger = OrderedMerger(combined_path, args.linearize) if combined_path and args.engine == 'pikepdf' and browsers == 1 else None
+  if browsers > 1:
+    results = render_with_browsers(files, out_dir, browsers, workers, blocked_types, args.block_remote, max_seconds)
+  else:
+    try:
+      results = asyncio.run(render_all(
+        files, out_dir, workers, blocked_types, args.block_remote,
+        on_result=merger.put if merger else None, max_seconds=max_seconds,
+      ))
+    finally:
+      merged = merger.close() if merger else 0
+  ok = sum(results)
+  fail = len(results) - ok
 
   # Merge into a single PDF if requested
-  if args.combined_output and ok > 0:
-    combined_path = Path(args.combined_output).expanduser().resolve()
-    writer = PdfWriter()
+  if merger is not None:
+    if merged:
+      print(f"Merged {merged} PDFs into {combined_path}")
+  elif combined_path and ok > 0:
+    generated_pdfs = [pdf_path_for(out_dir, f) for f, rendered in zip(files, results) if rendered]
     print(f"Merging {len(generated_pdfs)} PDFs into {combined_path}")
-    for pdf_path in generated_pdfs:
-      try:
-        reader = PdfReader(str(pdf_path))
-        for page in reader.pages:
-          writer.add_page(page)
-      except Exception as e:
-        print(f"[SKIP] {pdf_path.name}: {e}")
-    combined_path.parent.mkdir(parents=True, exist_ok=True)
-    with combined_path.open('wb') as f:
-      writer.write(f)
+    try:
+      merge_files(generated_pdfs, combined_path, args.engine, max(1, args.merge_jobs), args.linearize)
+    except MergeError as e:
+      print(f"ERROR: {e}")
+      return 1
     print("Merged PDF created.")
 
   print(f"Done. Success: {ok}, Failed: {fail}")
@@ -11,54 +11,321 @@ Usage:
 Sorting:
 - Attempts natural numeric ordering by filename stem if possible (e.g., 1, 2, 10, 11, ...)
 - Falls back to lexicographic order if not purely numeric
+
+Engines (--engine):
+- pikepdf  (default) native page-tree splicing via libqpdf
+- qpdf-cli shells out to `qpdf --empty --pages ...`, which streams inputs
+- pypdf    pure-Python fallback; appends one source at a time
+
+Large inputs are merged as a tree: the files are split into up to --jobs contiguous
+shards of at least SHARD_SIZE files each, the shards are merged in parallel worker
+processes, then the shard outputs are merged in order.
+
+Prereqs:
+  .venv/bin/python -m pip install pikepdf   # or pypdf, or install the qpdf binary
 """
 from __future__ import annotations
 
 import argparse
 import fnmatch
+import gc
+import io
+import os
+import shutil
+import queue
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, List, Optional, Union
+
+# pypdf leaves parsed readers to the cyclic GC; collect explicitly every N inputs
+GC_EVERY = 50
+LEADING_NUM_RE = re.compile(r'^(\d+)')
+# Above this many inputs the pypdf engine hands over to pikepdf when it is installed
+PYPDF_MAX_FILES = 500
+# Minimum number of input files per shard in a parallel tree merge; the shard count is
+# capped by the job count, so big inputs get proportionally bigger shards
+SHARD_SIZE = 200
+
+
+class MergeError(Exception):
+  """A merge backend failed as a whole (as opposed to skipping one input)."""
+
+
+def _sort_key(stem: str):
+  # natural-ish sort: try numeric stem first, using the leading integer if present
+  m = LEADING_NUM_RE.match(stem)
+  return (0, int(m.group(1))) if m else (1, stem.lower())
 
-from pypdf import PdfWriter, PdfReader
+
+def compile_name_matcher(pattern: str) -> Callable[[str], bool]:
+  """Build a filename predicate for a glob pattern once, outside the per-entry loop."""
+  suffix = pattern[1:]
+  # Common '*.ext' case: one C-level endswith per entry (fnmatch is case-insensitive on
+  # Windows, so keep the normcase path there)
+  if pattern.startswith('*.') and not any(c in suffix for c in '*?[') and os.path.normcase('A') == 'A':
+    return lambda name: name.endswith(suffix)
+  rx = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+  return lambda name: rx.match(os.path.normcase(name)) is not None
+
+
+def _scan(input_dir: Path, pattern: str, key: Callable[[str], tuple]) -> List[Path]:
+  """Files in input_dir matching pattern, sorted by key(stem) computed once per file."""
+  # scandir reuses the d_type from readdir, so is_file() needs no extra stat per entry
+  match = compile_name_matcher(pattern)
+  entries = []
+  with os.scandir(input_dir) as it:
+    for entry in it:
+      if entry.is_file(follow_symlinks=False) and match(entry.name):
+        entries.append((key(os.path.splitext(entry.name)[0]), entry.path))
+  entries.sort(key=lambda e: e[0])
+  return [Path(path) for _, path in entries]
 
 
 def iter_pdf_files(input_dir: Path, pattern: str) -> List[Path]:
-  files = [p for p in input_dir.iterdir() if p.is_file() and fnmatch.fnmatch(p.name, pattern)]
-  # natural-ish sort: try numeric stem first
-  def sort_key(p: Path):
-    stem = p.stem
-    num = None
-    # extract leading integer if present
-    i = 0
-    while i < len(stem) and stem[i].isdigit():
-      i += 1
-    if i > 0:
+  return _scan(input_dir, pattern, _sort_key)
+
+
+def _save_pikepdf(out, output_file: Path, linearize: bool = False) -> None:
+  import pikepdf
+
+  # Serialization runs in qpdf; skip every optional rewrite of already-compressed content.
+  # compress_streams stays at its default (on) so the generated object streams are deflated.
+  out.save(
+    str(output_file),
+    linearize=linearize,
+    # Copy content streams as-is (byte for byte) instead of decoding and re-encoding them
+    stream_decode_level=pikepdf.StreamDecodeLevel.none,
+    object_stream_mode=pikepdf.ObjectStreamMode.generate,
+    normalize_content=False,
+    recompress_flate=False,
+    preserve_pdfa=False,
+  )
+
+
+def _merge_pikepdf(files: List[Path], output_file: Path, linearize: bool = False, verbose: bool = True) -> None:
+  import pikepdf
+
+  # pikepdf (libqpdf) splices page trees natively instead of copying objects page by page in Python
+  with pikepdf.Pdf.new() as out:
+    for pdf_path in files:
       try:
-        num = int(stem[:i])
-      except Exception:
-        num = None
-    return (0, num) if num is not None else (1, stem.lower())
-  return sorted(files, key=sort_key)
+        with pikepdf.Pdf.open(str(pdf_path)) as src:
+          out.pages.extend(src.pages)
+        if verbose:
+          print(f"[OK]   {pdf_path.name}")
+      except Exception as e:
+        print(f"[SKIP] {pdf_path.name}: {e}")
+    _save_pikepdf(out, output_file, linearize)
+
+
+def _merge_qpdf_cli(files: List[Path], output_file: Path, linearize: bool = False, verbose: bool = True) -> None:
+  # Pass arguments through an @file so tens of thousands of inputs don't hit ARG_MAX.
+  # Unlike the Python engines, qpdf fails the whole merge on an unreadable input; inputs it
+  # can repair only produce warnings, which --warning-exit-0 keeps from failing the merge.
+  args = ['--warning-exit-0', '--empty', *(['--linearize'] if linearize else []), '--pages', *(str(p) for p in files), '--', str(output_file)]
+  fd, args_file = tempfile.mkstemp(suffix='.qpdfargs')
+  try:
+    with os.fdopen(fd, 'w') as f:
+      f.write('\n'.join(args) + '\n')
+    proc = subprocess.run(['qpdf', f'@{args_file}'])
+  except FileNotFoundError:
+    raise MergeError("qpdf executable not found; install qpdf or choose another --engine") from None
+  finally:
+    os.unlink(args_file)
+  if proc.returncode != 0:
+    raise MergeError(f"qpdf failed with exit code {proc.returncode}")
+  if verbose:
+    for pdf_path in files:
+      print(f"[OK]   {pdf_path.name}")
 
 
-def merge_pdfs(input_dir: Path, pattern: str, output_file: Path) -> None:
+def _merge_pypdf(files: List[Path], output_file: Path, linearize: bool = False, verbose: bool = True) -> None:
+  from pypdf import PdfWriter
+
+  if linearize:
+    print("[WARN] pypdf cannot linearize; writing a regular PDF")
   writer = PdfWriter()
-  files = iter_pdf_files(input_dir, pattern)
-  if not files:
-    print(f"No PDFs found in {input_dir} matching {pattern}")
-    return
-  print(f"Merging {len(files)} PDFs into {output_file}")
-  for pdf_path in files:
+  for i, pdf_path in enumerate(files, 1):
     try:
-      reader = PdfReader(str(pdf_path))
-      for page in reader.pages:
-        writer.add_page(page)
-      print(f"[OK]   {pdf_path.name}")
+      # append() clones each source once with a shared object cache, unlike per-page add_page()
+      writer.append(str(pdf_path), outline_item=None, pages=None, import_outline=False)
+      if verbose:
+        print(f"[OK]   {pdf_path.name}")
     except Exception as e:
       print(f"[SKIP] {pdf_path.name}: {e}")
-  output_file.parent.mkdir(parents=True, exist_ok=True)
+    if i % GC_EVERY == 0:
+      gc.collect()
+  # Per-question PDFs share the same template fonts/images; write each resource only once
+  if hasattr(writer, 'compress_identical_objects'):  # pypdf >= 4.3
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=False)
   with output_file.open('wb') as f:
     writer.write(f)
+
+
+_ENGINES = {
+  'pikepdf': _merge_pikepdf,
+  'qpdf-cli': _merge_qpdf_cli,
+  'pypdf': _merge_pypdf,
+}
+MERGE_ENGINES = tuple(_ENGINES)
+
+
+def _page_weights(files: List[Path]) -> List[int]:
+  """Page count per file when pikepdf is available, else file size as a proxy."""
+  try:
+    import pikepdf
+  except ImportError:
+    pikepdf = None
+  weights: List[int] = []
+  for pdf_path in files:
+    try:
+      if pikepdf is not None:
+        with pikepdf.Pdf.open(str(pdf_path)) as src:
+          weights.append(len(src.pages))
+      else:
+        weights.append(pdf_path.stat().st_size)
+    except Exception:
+      weights.append(0)  # the merge itself reports it as [SKIP]
+  return weights
+
+
+def _shard(files: List[Path], n_shards: int) -> List[List[Path]]:
+  """Split files into n_shards contiguous runs of roughly equal page weight, keeping order."""
+  weights = _page_weights(files)
+  total = sum(weights) or 1
+  shards: List[List[Path]] = [[]]
+  acc = 0
+  for pdf_path, w in zip(files, weights):
+    # Start the next shard once this one has reached its share of the total weight
+    if shards[-1] and acc >= total * len(shards) / n_shards and len(shards) < n_shards:
+      shards.append([])
+    shards[-1].append(pdf_path)
+    acc += w
+  return shards
+
+
+def _merge_shard(engine: str, files: List[Path], output_file: Path) -> Path:
+  _ENGINES[engine](files, output_file)
+  return output_file
+
+
+def merge_files(
+  files: List[Path],
+  output_file: Path,
+  engine: str = 'pikepdf',
+  jobs: int = 1,
+  linearize: bool = False,
+) -> None:
+  """
+  Concatenate files into output_file in order; unreadable inputs are skipped.
+  linearize writes a web-optimized PDF for progressive loading (costs an extra pass).
+  """
+  output_file.parent.mkdir(parents=True, exist_ok=True)
+  if engine == 'pypdf' and len(files) > PYPDF_MAX_FILES:
+    try:
+      import pikepdf  # noqa: F401
+      print(f"{len(files)} inputs exceed {PYPDF_MAX_FILES}; using the pikepdf engine instead of pypdf")
+      engine = 'pikepdf'
+    except ImportError:
+      pass
+  n_shards = min(jobs, -(-len(files) // SHARD_SIZE))
+  if n_shards <= 1:
+    _ENGINES[engine](files, output_file, linearize)
+    return
+
+  shards = _shard(files, n_shards)
+  tmp_dir = Path(tempfile.mkdtemp(prefix='merge_shards_'))
+  try:
+    parts = [tmp_dir / f"shard_{i:04d}.pdf" for i in range(len(shards))]
+    with ProcessPoolExecutor(max_workers=len(shards)) as pool:
+      futures = [pool.submit(_merge_shard, engine, shard, part) for shard, part in zip(shards, parts)]
+      merged = [f.result() for f in futures]
+    # Only the final output is linearized; shard intermediates never need it. The inputs
+    # were already reported per file by the shard workers, so don't list the intermediates.
+    _ENGINES[engine](merged, output_file, linearize, verbose=False)
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class OrderedMerger:
+  """
+  Background pikepdf merger for a producer that finishes files out of order.
+
+  Call put(index, source) once for every input index, where source is a PDF path,
+  in-memory PDF bytes, or None for a failed input; then close(). Sources are
+  appended in index order as soon as all earlier indices have arrived, so merging
+  overlaps with whatever produces the files.
+  """
+
+  def __init__(self, output_file: Path, linearize: bool = False) -> None:
+    self.output_file = output_file
+    self.linearize = linearize
+    self.merged = 0
+    self._queue: queue.Queue = queue.Queue()
+    self._error: Optional[BaseException] = None
+    self._thread = threading.Thread(target=self._run, name='pdf-merger', daemon=True)
+    self._thread.start()
+
+  def put(self, index: int, source: Union[Path, bytes, None]) -> None:
+    self._queue.put((index, source))
+
+  def close(self) -> int:
+    """Wait for the merge to finish and write output_file; return the number of merged inputs."""
+    self._queue.put(None)
+    self._thread.join()
+    if self._error is not None:
+      raise self._error
+    return self.merged
+
+  def _run(self) -> None:
+    import pikepdf
+
+    try:
+      with pikepdf.Pdf.new() as out:
+        # Reorder buffer: arrivals wait here until every earlier index has been handled
+        pending: Dict[int, Union[Path, bytes, None]] = {}
+        next_index = 0
+        while (item := self._queue.get()) is not None:
+          pending[item[0]] = item[1]
+          while next_index in pending:
+            source = pending.pop(next_index)
+            next_index += 1
+            if source is None:
+              continue
+            try:
+              # Bytes come straight from the renderer, skipping a write and re-read on disk
+              opened = io.BytesIO(source) if isinstance(source, bytes) else str(source)
+              with pikepdf.Pdf.open(opened) as src:
+                out.pages.extend(src.pages)
+              self.merged += 1
+            except Exception as e:
+              label = source.name if isinstance(source, Path) else f"input #{next_index - 1}"
+              print(f"[SKIP] {label}: {e}")
+        if self.merged:
+          self.output_file.parent.mkdir(parents=True, exist_ok=True)
+          _save_pikepdf(out, self.output_file, self.linearize)
+    except BaseException as e:
+      self._error = e
+
+
+def merge_pdfs(
+  input_dir: Path,
+  pattern: str,
+  output_file: Path,
+  engine: str = 'pikepdf',
+  jobs: int = 1,
+  linearize: bool = False,
+) -> None:
+  files = iter_pdf_files(input_dir, pattern)
+  if not files:
+    print(f"No PDFs found in {input_dir} matching {pattern}")
+    return
+  print(f"Merging {len(files)} PDFs into {output_file}")
+  merge_files(files, output_file, engine, jobs, linearize)
   print("Done.")
 
 
@@ -67,6 +334,9 @@ def main() -> int:
   ap.add_argument('--input-dir', type=str, required=True)
   ap.add_argument('--pattern', type=str, default='*.pdf')
   ap.add_argument('--output', type=str, required=True)
+  ap.add_argument('--engine', choices=MERGE_ENGINES, default='pikepdf', help='PDF merge backend (default: pikepdf)')
+  ap.add_argument('--linearize', action='store_true', help='Write a linearized (web-optimized) PDF for progressive loading; slower to produce')
+  ap.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes for sharded merging of large inputs (default: cpu_count)')
   args = ap.parse_args()
 
   in_dir = Path(args.input_dir).expanduser().resolve()
@@ -76,7 +346,11 @@ def main() -> int:
     print(f"ERROR: input-dir does not exist or is not a directory: {in_dir}")
     return 2
 
-  merge_pdfs(in_dir, args.pattern, out_path)
+  try:
+    merge_pdfs(in_dir, args.pattern, out_path, args.engine, max(1, args.jobs), args.linearize)
+  except MergeError as e:
+    print(f"ERROR: {e}")
+    return 1
   return 0
 
 